@@ -1,12 +1,14 @@
 # app.py
 import streamlit as st
 import os
+import shutil
 from datetime import datetime
 
 # Local imports
-from utils.pdf_utils import extract_text_and_metadata
+from utils.pdf_utils import extract_text_and_metadata, legacy_text_hash
 from utils.chunking import chunk_text
-from db_helpers import PaperDB
+from db_helpers import PaperDB, compute_file_hash
+from embedding_index import start_embed_preload
 from llm_utils import LLM
 
 # ----------------------------
@@ -17,8 +19,6 @@ INDEX_PATH = "faiss.index"
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-llm_device = "cuda" if __import__("torch").cuda.is_available() else "cpu"
-
 # ----------------------------
 # Streamlit Page Setup
 # ----------------------------
@@ -29,14 +29,33 @@ st.title("LLM Research Paper Analyzer")
 # ----------------------------
 # Cached initialization
 # ----------------------------
+# The DB is opened on every page; the vector store (PaperDB.vs) and the LLM are only built
+# by the pages that use them, so the Stored Papers tab never waits on torch/transformers.
 @st.cache_resource
-def get_db_and_llm():
+def get_db():
     pdb = PaperDB(db_path=DB_PATH, index_path=INDEX_PATH, embed_dim=384)
-    llm = LLM(device=llm_device)
-    return pdb, llm
+    # load the embedding model in the background while the user picks a page
+    start_embed_preload()
+    return pdb
+
+
+@st.cache_resource
+def get_llm():
+    import torch
+
+    llm_device = "cuda" if torch.cuda.is_available() else "cpu"
+    return LLM(device=llm_device)
 
 
-pdb, llm = get_db_and_llm()
+pdb = get_db()
+
+def show_stored_analysis(row):
+    st.warning("⚠️ This paper has already been analyzed earlier.")
+    st.subheader("Final Summary (from DB)")
+    st.write(row["summary"])
+    st.subheader("Research Gaps / Future Work (from DB)")
+    st.write(row["gaps"])
+
 
 # ----------------------------
 # Sidebar menu
@@ -58,18 +77,37 @@ if menu == "Upload & Process":
             st.session_state.uploaded_file_name = uploaded_file.name
             st.session_state.paper_info = None
             st.session_state.save_path = None
+            st.session_state.file_hash = None
 
         if st.session_state.paper_info is None:
             if st.button("Extract & Process"):
+                # Duplicate detection on the raw bytes, before any extraction work
+                uploaded_file.seek(0)
+                file_hash = compute_file_hash(uploaded_file)
+                existing = pdb.get_by_hash(file_hash)
+                if existing:
+                    show_stored_analysis(existing)
+                    st.stop()
+
                 with st.spinner("Extracting text from PDF..."):
                     save_path = os.path.join(
                         UPLOAD_DIR,
                         f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uploaded_file.name}"
                     )
+                    uploaded_file.seek(0)
                     with open(save_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
+                        shutil.copyfileobj(uploaded_file, f, 1024 * 1024)
+                    # papers stored before byte hashing are keyed by the hash of their pypdf text;
+                    # only pay for that extra pypdf pass while such rows remain
+                    if pdb.has_legacy_hashes():
+                        existing = pdb.claim_legacy_hash(legacy_text_hash(save_path), file_hash)
+                        if existing:
+                            os.remove(save_path)
+                            show_stored_analysis(existing)
+                            st.stop()
                     st.session_state.paper_info = extract_text_and_metadata(save_path)
                     st.session_state.save_path = save_path
+                    st.session_state.file_hash = file_hash
                 st.success(f"File saved and extracted: {save_path}")
                 st.rerun()
 
@@ -89,15 +127,12 @@ if menu == "Upload & Process":
             submitted = st.form_submit_button("Start full pipeline")
             if submitted:
                 # Insert paper (with duplicate detection)
-                paper_id, exists = pdb.insert_paper(title, authors, abstract, st.session_state.save_path, full_text)
+                paper_id, exists = pdb.insert_paper(
+                    title, authors, abstract, st.session_state.save_path, st.session_state.file_hash
+                )
 
                 if exists:
-                    st.warning("⚠️ This paper has already been analyzed earlier.")
-                    paper = pdb.get_paper(paper_id)
-                    st.subheader("Final Summary (from DB)")
-                    st.write(paper[5])  # summary
-                    st.subheader("Research Gaps / Future Work (from DB)")
-                    st.write(paper[7])  # gaps
+                    show_stored_analysis(pdb.get_paper(paper_id))
 
                 else:
                     st.info(f"Inserted paper id = {paper_id}")
@@ -117,6 +152,8 @@ if menu == "Upload & Process":
                     st.success("Embeddings indexed")
 
                     # Summarization
+                    with st.spinner("Loading summarization model..."):
+                        llm = get_llm()
                     with st.spinner("Generating summaries..."):
                         final_summary, combined_chunk_summaries = llm.summarize_chunks_pipeline(
                             chunks, chunk_max_length=100, final_max_length=256
@@ -146,16 +183,24 @@ if menu == "Upload & Process":
 # ----------------------------
 elif menu == "Search":
     st.header("Semantic Search (FAISS Embeddings)")
-    query = st.text_input("Enter your search query")
+    query_text = st.text_area("Enter your search query (one per line to compare several queries)")
+    queries = [q.strip() for q in query_text.splitlines() if q.strip()]
     top_k = st.slider("Top K", min_value=1, max_value=10, value=5)
 
     if st.button("Search"):
-        if query and pdb.vs.index.ntotal > 0:
+        if queries and pdb.vs.index.ntotal > 0:
             with st.spinner("Searching..."):
-                results = pdb.semantic_search(query, top_k=top_k)
-            if not results:
-                st.warning("No results found. The index might be empty or the query is not relevant.")
-            else:
+                # several queries go through one batched encode + index search
+                if len(queries) == 1:
+                    all_results = [pdb.semantic_search(queries[0], top_k=top_k)]
+                else:
+                    all_results = pdb.semantic_search_batch(queries, top_k=top_k)
+            for query, results in zip(queries, all_results):
+                if len(queries) > 1:
+                    st.subheader(query)
+                if not results:
+                    st.warning("No results found. The index might be empty or the query is not relevant.")
+                    continue
                 for r in results:
                     st.write(
                         f"Score: {r['score']:.3f} — Paper ID: {r['paper_id']} — Chunk ID: {r['chunk_id']}"
@@ -177,15 +222,14 @@ elif menu == "Stored Papers":
         st.info("No papers processed yet.")
     else:
         for row in rows:
-            pid, title, authors, abstract, summary, created_at = row
-            with st.expander(f"{pid} — {title}"):
-                st.write("Authors:", authors)
-                st.write("Abstract:", abstract)
-                st.write("Summary:", summary)
-                st.caption(f"Uploaded on {created_at}")
+            pid = row["id"]
+            with st.expander(f"{pid} — {row['title']}"):
+                st.write("Authors:", row["authors"])
+                st.write("Abstract:", row["abstract"])
+                st.write("Summary:", row["summary"])
+                st.caption(f"Uploaded on {row['created_at']}")
 
                 if st.button(f"View chunks for {pid}"):
-                    chunks = pdb.get_chunks_for_paper(pid)
-                    for cid, order, txt in chunks:
-                        st.write(f"Chunk {order} (id={cid}):")
-                        st.write(txt[:800])
+                    for chunk in pdb.iter_chunks_for_paper(pid):
+                        st.write(f"Chunk {chunk['chunk_order']} (id={chunk['id']}):")
+                        st.write(chunk["chunk_text"][:800])
@@ -1,6 +1,7 @@
 # db_helpers.py
 import sqlite3
-from embedding_index import VectorStore
+import threading
+from embedding_index import VectorStore, SQLITE_PRAGMAS
 import os
 import hashlib
 
@@ -15,6 +16,8 @@ CREATE TABLE IF NOT EXISTS papers (
     summary TEXT,
     combined_chunk_summaries TEXT,
     gaps TEXT,
+    -- 'bytes' for SHA-256 of the raw PDF; NULL for legacy rows keyed by SHA-256 of the pypdf text
+    hash_source TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -27,66 +30,154 @@ CREATE TABLE IF NOT EXISTS chunks (
     end_page INTEGER DEFAULT NULL,
     FOREIGN KEY(paper_id) REFERENCES papers(id)
 );
+
+CREATE INDEX IF NOT EXISTS idx_chunks_paper ON chunks(paper_id);
 """
 
-def compute_hash(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+SQL_GET_BY_HASH = "SELECT id, summary, gaps FROM papers WHERE file_hash=?"
+SQL_LIST_PAPERS = "SELECT id, title, authors, abstract, summary, created_at FROM papers ORDER BY created_at DESC"
+SQL_GET_PAPER = (
+    "SELECT id, title, authors, abstract, file_path, summary, combined_chunk_summaries, gaps "
+    "FROM papers WHERE id=?"
+)
+SQL_GET_CHUNKS = "SELECT id, chunk_order, chunk_text FROM chunks WHERE paper_id=? ORDER BY chunk_order ASC"
+
+def compute_file_hash(fileobj, chunk_size=1 << 20) -> str:
+    """SHA-256 of a binary file-like object, read in chunk_size blocks from its current position."""
+    h = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(chunk_size), b""):
+        h.update(block)
+    return h.hexdigest()
 
 class PaperDB:
     def __init__(self, db_path="papers.db", index_path="faiss.index", embed_dim=384):
         self.db_path = db_path
         os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # rows are addressable by column name (row["summary"]) as well as by position
+        self.conn.row_factory = sqlite3.Row
         self.cur = self.conn.cursor()
+        self.cur.executescript(SQLITE_PRAGMAS)
         self.cur.executescript(DB_SCHEMA)
+        columns = {r["name"] for r in self.conn.execute("PRAGMA table_info(papers)")}
+        if "hash_source" not in columns:
+            # DB from before byte hashing: existing rows keep NULL, i.e. a legacy text hash
+            self.cur.execute("ALTER TABLE papers ADD COLUMN hash_source TEXT")
         self.conn.commit()
-        # always use FAISS-CPU
-        self.vs = VectorStore(db_path=self.db_path, index_path=index_path, dim=embed_dim)
+        self.index_path = index_path
+        self.embed_dim = embed_dim
+        self._vs = None
+        # PaperDB is shared by every Streamlit session (st.cache_resource), so creation must happen once
+        self._vs_lock = threading.Lock()
+
+    @property
+    def vs(self):
+        """The VectorStore, created on first access so DB-only pages skip loading FAISS and the embedder."""
+        if self._vs is None:
+            with self._vs_lock:
+                if self._vs is None:
+                    # always use FAISS-CPU
+                    self._vs = VectorStore(db_path=self.db_path, index_path=self.index_path, dim=self.embed_dim)
+        return self._vs
 
-    def insert_paper(self, title, authors, abstract, file_path, full_text):
-        file_hash = compute_hash(full_text)
-        self.cur.execute("SELECT id FROM papers WHERE file_hash=?", (file_hash,))
+    def get_by_hash(self, file_hash):
+        """Return (id, summary, gaps) of the paper with this file hash, or None."""
+        return self.conn.execute(SQL_GET_BY_HASH, (file_hash,)).fetchone()
+
+    def has_legacy_hashes(self):
+        """True while some paper is still keyed by the legacy text hash (see claim_legacy_hash)."""
+        return self.conn.execute("SELECT 1 FROM papers WHERE hash_source IS NULL LIMIT 1").fetchone() is not None
+
+    def claim_legacy_hash(self, text_hash, file_hash):
+        """
+        Papers inserted before duplicate detection moved to raw PDF bytes stored the SHA-256 of
+        their pypdf-extracted text (see utils.pdf_utils.legacy_text_hash). If text_hash matches such a row, re-key it to file_hash so later
+        uploads hit get_by_hash directly, and return (id, summary, gaps); otherwise None.
+        """
+        self.cur.execute(
+            "SELECT id, summary, gaps FROM papers WHERE file_hash=? AND hash_source IS NULL", (text_hash,)
+        )
         row = self.cur.fetchone()
+        if row:
+            self.cur.execute(
+                "UPDATE papers SET file_hash=?, hash_source='bytes' WHERE id=?", (file_hash, row["id"])
+            )
+            self.conn.commit()
+        return row
+
+    def insert_paper(self, title, authors, abstract, file_path, file_hash):
+        """file_hash: SHA-256 of the raw PDF bytes (see compute_file_hash)."""
+        row = self.get_by_hash(file_hash)
         if row:
             return row[0], True
         self.cur.execute(
-            "INSERT INTO papers (title, authors, abstract, file_path, file_hash) VALUES (?, ?, ?, ?, ?)",
+            "INSERT INTO papers (title, authors, abstract, file_path, file_hash, hash_source) "
+            "VALUES (?, ?, ?, ?, ?, 'bytes')",
             (title, authors, abstract, file_path, file_hash)
         )
         self.conn.commit()
         return self.cur.lastrowid, False
 
     def insert_chunks(self, paper_id, chunk_texts):
-        chunk_ids = []
-        for i, txt in enumerate(chunk_texts):
-            self.cur.execute(
+        rows = [(paper_id, txt, i) for i, txt in enumerate(chunk_texts)]
+        if not rows:
+            return []
+        # one prepared statement reused for every row, committed once
+        with self.conn:
+            self.cur.executemany(
                 "INSERT INTO chunks (paper_id, chunk_text, chunk_order) VALUES (?, ?, ?)",
-                (paper_id, txt, i)
+                rows
             )
-            chunk_ids.append(self.cur.lastrowid)
-        self.conn.commit()
+            # executemany does not set lastrowid, so read the new ids back in one query
+            self.cur.execute(
+                "SELECT id FROM chunks WHERE paper_id=? ORDER BY id DESC LIMIT ?",
+                (paper_id, len(rows))
+            )
+            chunk_ids = [r[0] for r in reversed(self.cur.fetchall())]
         return chunk_ids
 
     def add_chunks_embeddings(self, chunk_texts, chunk_ids):
         self.vs.add_embeddings(chunk_texts, chunk_ids)
+        # persist once per paper, right away: the chunk rows are already committed, so losing
+        # their vectors during the (slow) summarization step would leave them unsearchable
+        self.vs.flush()
 
     def semantic_search(self, query, top_k=5):
-        D, I = self.vs.search(query, top_k=top_k)
-        chunk_ids = self.vs.map_index_to_chunk_ids(I)
-        results = []
-        for score, cid in zip(D, chunk_ids):
-            if cid is None:
-                continue
-            self.cur.execute("SELECT chunk_text, paper_id FROM chunks WHERE id=?", (cid,))
-            r = self.cur.fetchone()
-            if r:
-                results.append({
-                    "score": float(score),
-                    "chunk_id": cid,
-                    "paper_id": r[1],
-                    "chunk_text": r[0]
-                })
-        return results
+        D, chunk_ids = self.vs.search(query, top_k=top_k)
+        return self._build_results([(D, chunk_ids)])[0]
+
+    def semantic_search_batch(self, queries, top_k=5):
+        """Like semantic_search for several queries at once; returns one result list per query."""
+        if not queries:
+            return []
+        D, I = self.vs.search_batch(queries, top_k=top_k)
+        return self._build_results(list(zip(D, I)))
+
+    def _build_results(self, hits):
+        """hits: list of (scores, chunk_ids) per query. Fetches all chunk rows in one query."""
+        found = sorted({int(cid) for _, chunk_ids in hits for cid in chunk_ids if cid >= 0})
+        if not found:
+            return [[] for _ in hits]
+        placeholders = ",".join("?" * len(found))
+        self.cur.execute(
+            f"SELECT id, chunk_text, paper_id FROM chunks WHERE id IN ({placeholders})",
+            found
+        )
+        rows = {r[0]: r for r in self.cur.fetchall()}
+        all_results = []
+        for D, chunk_ids in hits:
+            results = []
+            for score, cid in zip(D, chunk_ids):
+                r = rows.get(int(cid))
+                if r:
+                    results.append({
+                        "score": float(score),
+                        "chunk_id": int(cid),
+                        "paper_id": r[2],
+                        "chunk_text": r[1]
+                    })
+            all_results.append(results)
+        return all_results
 
     def save_summary_and_gaps(self, paper_id, final_summary, combined_summaries_text, gaps_text):
         self.cur.execute(
@@ -96,23 +187,19 @@ class PaperDB:
         self.conn.commit()
 
     def list_papers(self):
-        self.cur.execute("SELECT id, title, authors, abstract, summary, created_at FROM papers ORDER BY created_at DESC")
-        return self.cur.fetchall()
+        return self.conn.execute(SQL_LIST_PAPERS).fetchall()
 
     def get_paper(self, paper_id):
-        self.cur.execute(
-            "SELECT id, title, authors, abstract, file_path, summary, combined_chunk_summaries, gaps FROM papers WHERE id=?",
-            (paper_id,)
-        )
-        return self.cur.fetchone()
+        return self.conn.execute(SQL_GET_PAPER, (paper_id,)).fetchone()
+
+    def iter_chunks_for_paper(self, paper_id):
+        """Lazily yield (id, chunk_order, chunk_text) rows on a dedicated cursor."""
+        yield from self.conn.execute(SQL_GET_CHUNKS, (paper_id,))
 
     def get_chunks_for_paper(self, paper_id):
-        self.cur.execute(
-            "SELECT id, chunk_order, chunk_text FROM chunks WHERE paper_id=? ORDER BY chunk_order ASC",
-            (paper_id,)
-        )
-        return self.cur.fetchall()
+        return list(self.iter_chunks_for_paper(paper_id))
 
     def close(self):
-        self.vs.close()
+        if self._vs is not None:
+            self._vs.close()
         self.conn.close()
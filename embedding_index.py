@@ -1,29 +1,107 @@
 # embedding_index.py
 import os
+import hashlib
+import logging
 import sqlite3
+import threading
+from functools import lru_cache
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+# torch, sentence_transformers and faiss are imported lazily: pages that never touch the
+# vector store (e.g. Stored Papers) should not pay their import cost.
 
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
+logger = logging.getLogger(__name__)
+
+# applied to every SQLite connection: WAL lets the app and the vector store read/write concurrently
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+"""
+
+# HNSW graph parameters: M neighbours per node, build/search beam widths
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# The embedding model is loaded once per process on a background thread (see start_embed_preload),
+# so weight I/O and torch init overlap with Streamlit startup instead of the first upload.
+_model_ready = threading.Event()
+_model_holder = {}
+_preload_lock = threading.Lock()
+_preload_started = False
+
+
+def _preload():
+    try:
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = SentenceTransformer(EMBED_MODEL, device=device)
+        if device == "cuda":
+            # fp16 halves the bytes moved per matmul; embeddings are returned as float32
+            model = model.half()
+        _model_holder["model"] = model
+        _model_holder["device"] = device
+    except Exception as e:
+        _model_holder["error"] = e
+    finally:
+        _model_ready.set()
+
+
+def start_embed_preload():
+    """Start loading the embedding model in the background; later calls are no-ops."""
+    global _preload_started
+    with _preload_lock:
+        if _preload_started:
+            return
+        _preload_started = True
+    threading.Thread(target=_preload, name="embed-model-preload", daemon=True).start()
+
+
+def get_embed_model():
+    """Return the shared SentenceTransformer and its device, blocking until the preload finishes."""
+    start_embed_preload()
+    _model_ready.wait()
+    if "error" in _model_holder:
+        raise _model_holder["error"]
+    return _model_holder["model"], _model_holder["device"]
+
+
+@lru_cache(maxsize=None)
+def _faiss():
+    """Import faiss on first use and configure its thread pool once."""
+    import faiss
+    # leave half the cores to the encoders/LLM; FAISS parallelizes over the query batch
+    faiss.omp_set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+    return faiss
+
+
 class VectorStore:
     """
-    Handles embeddings (SentenceTransformer) + FAISS index + mapping to SQLite chunk IDs.
+    Handles embeddings (SentenceTransformer) + FAISS index keyed by SQLite chunk IDs.
     CPU-only version (uses faiss-cpu).
     """
     def __init__(self, db_path="papers.db", index_path="faiss.index", dim=384):
         self.db_path = db_path
         self.index_path = index_path
         self.dim = dim
-        self.model = SentenceTransformer(EMBED_MODEL)
+        self.model, self.device = get_embed_model()
+        # per-instance LRU of normalized query embeddings (stored as immutable bytes)
+        self._encode_query = lru_cache(maxsize=256)(self._encode_query_uncached)
 
         # ensure DB connection
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.cur = self.conn.cursor()
+        self.cur.executescript(SQLITE_PRAGMAS)
+        # text hash -> chunk ID whose vector is already in the index, to skip re-embedding duplicate text
         self.cur.executescript("""
-        CREATE TABLE IF NOT EXISTS faiss_mapping (
-            faiss_idx INTEGER PRIMARY KEY,
+        CREATE TABLE IF NOT EXISTS chunk_hash (
+            hash TEXT PRIMARY KEY,
             chunk_id INTEGER
         );
         """)
@@ -31,58 +109,151 @@ class VectorStore:
 
         self._load_or_create_index()
 
+    def _new_index(self):
+        faiss = _faiss()
+        # cosine similarity: normalized vectors + inner product; IDMap2 stores chunk IDs as FAISS ids
+        hnsw = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+
     def _load_or_create_index(self):
+        faiss = _faiss()
         if os.path.exists(self.index_path):
             self.index = faiss.read_index(self.index_path)
+            if not isinstance(self.index, faiss.IndexIDMap2):
+                self._migrate_flat_index()
         else:
-            # use cosine similarity: normalize vectors + IndexFlatIP
-            self.index = faiss.IndexFlatIP(self.dim)
-            faiss.write_index(self.index, self.index_path)
+            self.index = self._new_index()
+        faiss.downcast_index(self.index.index).hnsw.efSearch = HNSW_EF_SEARCH
+
+    def _migrate_flat_index(self):
+        """Rebuild an older positional IndexFlatIP (+ faiss_mapping table) as an ID-keyed HNSW index."""
+        old = self.index
+        self.index = self._new_index()
+        self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='faiss_mapping'")
+        has_mapping = self.cur.fetchone() is not None
+        if old.ntotal and not has_mapping:
+            # positions cannot be tied back to chunks; keep the old file rather than overwrite it
+            backup_path = self.index_path + ".bak"
+            os.replace(self.index_path, backup_path)
+            logger.warning(
+                "FAISS index %s has %d vectors but no faiss_mapping table; moved it to %s and "
+                "started an empty index (re-process papers to make them searchable again)",
+                self.index_path, old.ntotal, backup_path,
+            )
+        elif old.ntotal:
+            # a crash between the old mapping commit and write_index can leave rows past ntotal
+            self.cur.execute(
+                "SELECT faiss_idx, chunk_id FROM faiss_mapping WHERE faiss_idx < ? ORDER BY faiss_idx",
+                (old.ntotal,)
+            )
+            rows = self.cur.fetchall()
+            self.cur.execute("SELECT COUNT(*) FROM faiss_mapping WHERE faiss_idx >= ?", (old.ntotal,))
+            dangling = self.cur.fetchone()[0]
+            if dangling:
+                logger.warning(
+                    "Skipping %d faiss_mapping rows that point past the %d vectors in %s",
+                    dangling, old.ntotal, self.index_path,
+                )
+            if rows:
+                positions = np.asarray([r[0] for r in rows], dtype="int64")
+                vectors = old.reconstruct_n(0, old.ntotal)[positions]
+                self.index.add_with_ids(vectors, np.asarray([r[1] for r in rows], dtype="int64"))
+        self.flush()
+
+    def _lookup_embedded(self, hashes, batch=500):
+        """Return {hash: chunk_id} for hashes whose text has already been embedded."""
+        found = {}
+        for i in range(0, len(hashes), batch):
+            part = hashes[i:i+batch]
+            placeholders = ",".join("?" * len(part))
+            self.cur.execute(f"SELECT hash, chunk_id FROM chunk_hash WHERE hash IN ({placeholders})", part)
+            found.update(self.cur.fetchall())
+        return found
 
-    def add_embeddings(self, texts, chunk_ids, batch_size=64):
+    def add_embeddings(self, texts, chunk_ids, batch_size=128):
         """
         texts: list of chunk texts
         chunk_ids: list of chunk IDs (must match order of texts)
+        Text already in the index (same BLAKE2b hash) reuses its stored vector instead of being re-encoded.
         """
+        import torch
+
         assert len(texts) == len(chunk_ids)
-        all_embs = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            emb = self.model.encode(batch, convert_to_numpy=True, show_progress_bar=False)
-            faiss.normalize_L2(emb)  # normalize for cosine similarity
-            all_embs.append(emb)
-        all_embs = np.vstack(all_embs).astype("float32")
-
-        start_pos = self.index.ntotal
-        self.index.add(all_embs)
-
-        # map FAISS positions to chunk_ids
-        for i, cid in enumerate(chunk_ids):
-            pos = start_pos + i
-            self.cur.execute(
-                "INSERT INTO faiss_mapping (faiss_idx, chunk_id) VALUES (?, ?)",
-                (int(pos), int(cid))
+        # non-cryptographic dedup key; BLAKE2b is faster than SHA-256
+        hashes = [hashlib.blake2b(t.encode("utf-8"), digest_size=16).hexdigest() for t in texts]
+        all_embs = np.empty((len(texts), self.dim), dtype=np.float32)
+
+        # reuse vectors for text embedded earlier, or seen earlier in this same call
+        first_seen = {}
+        to_encode = []
+        copies = []
+        embedded = self._lookup_embedded(hashes)
+        for pos, h in enumerate(hashes):
+            if h in embedded:
+                try:
+                    all_embs[pos] = self.index.reconstruct(int(embedded[h]))
+                    continue
+                except RuntimeError:
+                    # mapped chunk missing from the index (e.g. never flushed); encode it again
+                    del embedded[h]
+            if h in first_seen:
+                copies.append((pos, first_seen[h]))
+            else:
+                first_seen[h] = pos
+                to_encode.append(pos)
+
+        with torch.inference_mode():
+            for i in range(0, len(to_encode), batch_size):
+                batch_pos = to_encode[i:i+batch_size]
+                # normalized for cosine similarity, written straight into the preallocated buffer
+                all_embs[batch_pos] = self.model.encode(
+                    [texts[p] for p in batch_pos],
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False,
+                )
+        for pos, src in copies:
+            all_embs[pos] = all_embs[src]
+
+        self.index.add_with_ids(all_embs, np.asarray(chunk_ids, dtype="int64"))
+        with self.conn:
+            self.cur.executemany(
+                "INSERT OR REPLACE INTO chunk_hash (hash, chunk_id) VALUES (?, ?)",
+                [(hashes[p], int(chunk_ids[p])) for p in to_encode]
             )
-        self.conn.commit()
-        faiss.write_index(self.index, self.index_path)
+
+    def _encode_query_uncached(self, query):
+        import torch
+
+        with torch.inference_mode():
+            q_emb = self.model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+        return q_emb.astype("float32", copy=False).tobytes()
 
     def search(self, query, top_k=5):
-        q_emb = self.model.encode([query], convert_to_numpy=True)
-        faiss.normalize_L2(q_emb)
-        D, I = self.index.search(q_emb.astype("float32"), top_k)
+        q_emb = np.frombuffer(self._encode_query(query), dtype="float32").reshape(1, self.dim)
+        D, I = self.index.search(q_emb, top_k)
+        # I holds chunk IDs directly (-1 where fewer than top_k hits)
         return D[0], I[0]
 
-    def map_index_to_chunk_ids(self, indices):
-        """Map FAISS positions back to chunk IDs from DB."""
-        chunk_ids = []
-        for idx in indices:
-            if idx < 0:
-                chunk_ids.append(None)
-                continue
-            self.cur.execute("SELECT chunk_id FROM faiss_mapping WHERE faiss_idx=?", (int(idx),))
-            r = self.cur.fetchone()
-            chunk_ids.append(r[0] if r else None)
-        return chunk_ids
+    def search_batch(self, queries, top_k=5):
+        """
+        Search several queries at once: one encode() call and one (nq, dim) index search.
+        Returns (D, I) arrays of shape (nq, top_k); I holds chunk IDs.
+        """
+        import torch
+
+        with torch.inference_mode():
+            q_emb = self.model.encode(queries, convert_to_numpy=True, normalize_embeddings=True)
+        return self.index.search(q_emb.astype("float32", copy=False), top_k)
+
+    def flush(self):
+        """Persist the index to disk; written to a temp file first so a crash never leaves a partial index."""
+        tmp_path = self.index_path + ".tmp"
+        _faiss().write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
 
     def close(self):
+        self.flush()
         self.conn.close()
@@ -1,43 +1,76 @@
 # llm_utils.py
 import os
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
 from tqdm import tqdm
+# torch and transformers are imported inside LLM so importing this module stays cheap;
+# the app only constructs an LLM when a paper is actually analyzed.
 
 # Use flan-t5-base for a good CPU/GPU balance. If you have lots of GPU memory, you can use flan-t5-large.
 SUM_MODEL = os.getenv("SUM_MODEL", "google/flan-t5-base")
 
+CHUNK_PROMPT = "Summarize the following excerpt from an academic paper in 1-2 concise sentences:\n\n{}"
+COMBINE_PROMPT = ("Given these chunk summaries from a research paper, produce a concise academic summary "
+                  "(2-4 sentences) capturing the main contributions and findings:\n\n{}")
+
+# flan-t5 input length; longer prompts are truncated by _generate
+MAX_INPUT_TOKENS = 512
+
 class LLM:
     def __init__(self, device=None):
         """
         device: "cuda" or "cpu" or None (auto-detect)
         """
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
         if device is None:
             device = "cuda" if torch.cuda.is_available() else "cpu"
         self.device = device
         self.tokenizer = AutoTokenizer.from_pretrained(SUM_MODEL)
         self.model = AutoModelForSeq2SeqLM.from_pretrained(SUM_MODEL)
         if self.device == "cuda" and torch.cuda.is_available():
-            self.model = self.model.to("cuda")
-            self.pipe = pipeline("text2text-generation", model=self.model, tokenizer=self.tokenizer, device=0)
+            if torch.cuda.is_bf16_supported():
+                # T5 is trained in bf16, so this halves memory traffic without the fp16 overflow issues
+                self.model = self.model.to("cuda", dtype=torch.bfloat16)
+            else:
+                # pre-Ampere GPUs (T4, V100) have no native bf16 matmuls; T5 overflows in fp16, so stay fp32
+                self.model = self.model.to("cuda")
         else:
-            self.pipe = pipeline("text2text-generation", model=self.model, tokenizer=self.tokenizer, device=-1)
+            self.device = "cpu"
+            # int8 dynamic quantization of the Linear layers: ~2-3x faster matmuls on CPU, half the weight memory
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+            torch.set_num_threads(os.cpu_count() or 1)
+        self.model.eval()
+        # one throwaway generate so kernel selection / autotuning happens at startup, not on the first paper
+        self._generate(["warmup"], 8)
+
+    def _generate(self, prompts, max_new_tokens):
+        """
+        Run one batched generate() over a list of prompts (padded together) and return the decoded outputs.
+        """
+        import torch
+
+        inputs = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, truncation=True, max_length=MAX_INPUT_TOKENS
+        ).to(self.device)
+        with torch.inference_mode():
+            out = self.model.generate(
+                **inputs, max_new_tokens=max_new_tokens, num_beams=1, do_sample=False, use_cache=True
+            )
+        return [t.strip() for t in self.tokenizer.batch_decode(out, skip_special_tokens=True)]
 
     def summarize_chunk(self, chunk_text, max_length=120):
         """
         Summarize a single chunk. Keep relatively short to then combine.
         """
-        prompt = f"Summarize the following excerpt from an academic paper in 1-2 concise sentences:\n\n{chunk_text}"
-        out = self.pipe(prompt, max_length=max_length, truncation=True)[0]["generated_text"]
-        return out.strip()
+        prompt = CHUNK_PROMPT.format(chunk_text)
+        return self._generate([prompt], max_new_tokens=max_length)[0]
 
     def summarize_combined(self, combined_text, max_length=256):
         """
         Produce a polished final summary from combined chunk summaries.
         """
-        prompt = f"Given these chunk summaries from a research paper, produce a concise academic summary (2-4 sentences) capturing the main contributions and findings:\n\n{combined_text}"
-        out = self.pipe(prompt, max_length=max_length, truncation=True)[0]["generated_text"]
-        return out.strip()
+        prompt = COMBINE_PROMPT.format(combined_text)
+        return self._generate([prompt], max_new_tokens=max_length)[0]
 
     def research_gap_analysis(self, final_context_text, max_length=256):
         """
@@ -46,21 +79,65 @@ class LLM:
         prompt = ("You are an expert researcher. Based on the provided summary/context, list (A) limitations or weaknesses "
                   "that are apparent and (B) actionable future work directions or unexplored areas. Output as clear bullet points.")
         prompt = prompt + "\n\n" + final_context_text
-        out = self.pipe(prompt, max_length=max_length, truncation=True)[0]["generated_text"]
-        return out.strip()
+        return self._generate([prompt], max_new_tokens=max_length)[0]
+
+    def _pack_bundles(self, texts):
+        """
+        Greedily group texts (as "- " bullet lines) into bundles whose COMBINE_PROMPT fits in
+        MAX_INPUT_TOKENS, so nothing is cut off by truncation (summaries are capped at max_new_tokens,
+        so any single one fits on its own). Returns a list of bundle strings.
+        """
+        lines = [f"- {t}" for t in texts]
+        budget = MAX_INPUT_TOKENS - len(self.tokenizer(COMBINE_PROMPT.format(""))["input_ids"])
+        line_lens = [len(ids) for ids in self.tokenizer(lines, add_special_tokens=False)["input_ids"]]
+        bundles, current, used = [], [], 0
+        for line, n in zip(lines, line_lens):
+            if current and used + n > budget:
+                bundles.append("\n".join(current))
+                current, used = [], 0
+            current.append(line)
+            used += n
+        bundles.append("\n".join(current))
+        return bundles
+
+    def _reduce(self, texts, max_length=120, batch_size=8):
+        """
+        Tree-reduce summaries: pack them into bundles that fit the model input, summarize each bundle
+        (batch_size per generate()), and repeat until everything fits in one bundle, which is returned.
+        """
+        bundles = self._pack_bundles(texts)
+        # stop if a level cannot shrink any further (every bundle holds a single text)
+        while 1 < len(bundles) < len(texts):
+            prompts = [COMBINE_PROMPT.format(b) for b in bundles]
+            texts = []
+            for i in range(0, len(prompts), batch_size):
+                texts.extend(self._generate(prompts[i:i+batch_size], max_new_tokens=max_length))
+            bundles = self._pack_bundles(texts)
+        return "\n".join(bundles)
 
-    def summarize_chunks_pipeline(self, chunks, chunk_max_length=120, final_max_length=256):
+    def summarize_chunks_pipeline(self, chunks, chunk_max_length=120, final_max_length=256, batch_size=8):
         """
-        Summarize each chunk, join those summaries, then re-summarize to get final summary.
+        Summarize each chunk, tree-reduce those summaries, then re-summarize to get final summary.
+        Chunks are summarized batch_size at a time with a single generate() per batch; batches are
+        formed from chunks of similar token length to minimize padding, then restored to original order.
         Returns (final_summary, combined_chunk_summaries_text)
         """
-        chunk_summaries = []
-        for c in tqdm(chunks, desc="Summarizing chunks"):
-            s = self.summarize_chunk(c, max_length=chunk_max_length)
-            chunk_summaries.append(s)
+        if not chunks:
+            # e.g. a scanned PDF with no extractable text; the tokenizer rejects an empty batch
+            return "", ""
+        prompts = [CHUNK_PROMPT.format(c) for c in chunks]
+        encoded = self.tokenizer(prompts, truncation=True, max_length=MAX_INPUT_TOKENS)
+        lens = [len(ids) for ids in encoded["input_ids"]]
+        order = sorted(range(len(prompts)), key=lens.__getitem__)
+        chunk_summaries = [None] * len(prompts)
+        for i in tqdm(range(0, len(order), batch_size), desc="Summarizing chunks"):
+            batch = order[i:i+batch_size]
+            outs = self._generate([prompts[j] for j in batch], max_new_tokens=chunk_max_length)
+            for j, out in zip(batch, outs):
+                chunk_summaries[j] = out
         # join chunk summaries into one big text (with delimiters)
         combined = "\n".join(f"- {s}" for s in chunk_summaries)
-        # optionally truncate combined if too long for model input
-        combined_trunc = combined if len(combined) < 15000 else combined[:15000]
-        final_summary = self.summarize_combined(combined_trunc, max_length=final_max_length)
+        # reduce long papers hierarchically until the summaries fit in one final prompt
+        reduced = self._reduce(chunk_summaries, batch_size=batch_size)
+        final_summary = self.summarize_combined(reduced, max_length=final_max_length)
         return final_summary, combined
@@ -1,24 +1,28 @@
+import re
+
+_WORD_RE = re.compile(r"\S+")
+
 
 def chunk_text(text, max_words=400, overlap_words=50):
     """
     Simple word-based chunker with overlap.
     Returns list of chunks (strings). Keeps order.
+    Chunks are slices of the original text between word offsets, so inner whitespace is preserved.
     """
     if not text:
         return []
-    words = text.split()
-    if len(words) <= max_words:
-        return [" ".join(words)]
+    spans = [m.span() for m in _WORD_RE.finditer(text)]
+    n = len(spans)
+    if n == 0:
+        return []
+    if n <= max_words:
+        return [text[spans[0][0]:spans[-1][1]]]
     chunks = []
     start = 0
-    while start < len(words):
-        end = min(start + max_words, len(words))
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        if end == len(words):
+    while start < n:
+        end = min(start + max_words, n)
+        chunks.append(text[spans[start][0]:spans[end - 1][1]])
+        if end == n:
             break
-        start = max(end - overlap_words, end) - (0 if end==len(words) else overlap_words)
-        # simpler move:
         start = end - overlap_words
     return chunks
-
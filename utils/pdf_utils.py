@@ -1,39 +1,93 @@
 # utils/pdf_utils.py
-from pypdf import PdfReader
+import hashlib
 import re
+from pypdf import PdfReader
+
+try:
+    import fitz  # PyMuPDF: C text extraction, much faster than pypdf on long papers
+except ImportError:
+    fitz = None
+
+_ABSTRACT_RE = re.compile(r"\babstract\b", re.IGNORECASE)
+# end of the abstract: an introduction/references heading, or a standalone short line (e.g. "Keywords")
+_ABSTRACT_END_RE = re.compile(
+    r"\n(?:1\.\s*)?introduction\b|\nreferences\b|\n[a-zA-Z0-9]{1,50}\n", re.IGNORECASE
+)
+
+
+def _extract_pages_fitz(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        return [page.get_text("text") or "" for page in doc]
+
+
+def _extract_pages_pypdf(pdf_path):
+    reader = PdfReader(pdf_path)
+    texts = []
+    for page in reader.pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        texts.append(text)
+    return texts
+
+
+def legacy_text_hash(pdf_path):
+    """
+    SHA-256 of full_text as built before PyMuPDF was introduced (pypdf pages joined by newlines),
+    which is what papers stored back then are keyed by. Hashed page by page, so the joined
+    text is never built.
+    """
+    h = hashlib.sha256()
+    for i, text in enumerate(_extract_pages_pypdf(pdf_path)):
+        if i:
+            h.update(b"\n")
+        h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
 
 def extract_text_and_metadata(pdf_path):
     """
     Extract text per page and attempt simple heuristics for title/abstract.
     Returns dict with: title, authors (empty), abstract, pages (list of {"page":int,"text":str}), full_text.
+    Uses PyMuPDF when installed, falling back to pypdf.
     """
-    reader = PdfReader(pdf_path)
-    pages = []
-    for i, page in enumerate(reader.pages):
+    texts = None
+    if fitz is not None:
         try:
-            text = page.extract_text() or ""
+            texts = _extract_pages_fitz(pdf_path)
         except Exception:
-            text = ""
-        pages.append({"page": i + 1, "text": text})
+            texts = None
+    if texts is None:
+        texts = _extract_pages_pypdf(pdf_path)
 
-    full_text = "\n".join(p["text"] for p in pages)
+    pages = [{"page": i + 1, "text": text} for i, text in enumerate(texts)]
+    full_text = "\n".join(texts)
 
     # Heuristic title: first non-empty line of first page longer than 10 chars
     title = ""
     if pages:
-        first_page_lines = [ln.strip() for ln in pages[0]["text"].splitlines() if ln.strip()]
-        for ln in first_page_lines:
+        for ln in pages[0]["text"].splitlines():
+            ln = ln.strip()
             if len(ln) > 10:
                 title = ln
                 break
 
     # Heuristic abstract extraction (look for the word 'Abstract' or 'ABSTRACT')
+    # Two bounded searches instead of one lazy regex with lookaheads over the whole text:
+    # find the heading, then the first section marker within the next 2000 chars.
     abstract = ""
-    m = re.search(r"(?is)\babstract\b[:\s]*(.+?)(?=\n[a-zA-Z0-9]{1,50}\n|Introduction\b|1\.\s+Introduction\b|References\b|$)", full_text)
+    m = _ABSTRACT_RE.search(full_text)
     if m:
-        abstract = m.group(1).strip()
-        # Trim to first 1000-2000 chars if extremely long
-        abstract = abstract[:2000]
+        start = m.end()
+        # skip the ':' / whitespace after the heading
+        while start < len(full_text) and (full_text[start] == ":" or full_text[start].isspace()):
+            start += 1
+        limit = start + 2000
+        # the abstract body is at least one char, as with the old lazy '.+?'
+        end_m = _ABSTRACT_END_RE.search(full_text, start + 1, limit)
+        end = end_m.start() if end_m else limit
+        abstract = full_text[start:end].strip()
 
     return {
         "title": title,